@@ -1,12 +1,11 @@
-import json
-import re
 import logging
 import os
-import io
 import time
+import uuid
 from flask import Flask, redirect, request, session, render_template
 import requests
-import base64
+from transfer_queue import get_queue, QUEUED, RUNNING, FAILED, QUEUED_TIMEOUT_SECONDS
+from transfers import SPOTIFY_API_BASE_URL, SOUNDCLOUD_API_BASE_URL
 
 app = Flask(__name__)
 app.secret_key = "your_secret_key"
@@ -20,25 +19,29 @@ SOUNDCLOUD_REDIRECT_URI = os.getenv("SOUNDCLOUD_REDIRECT_URI")
 
 SPOTIFY_AUTH_URL = "https://accounts.spotify.com/authorize"
 SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
-SPOTIFY_API_BASE_URL = "https://api.spotify.com/v1"
 SOUNDCLOUD_AUTH_URL = "https://soundcloud.com/connect"
 SOUNDCLOUD_TOKEN_URL = "https://api.soundcloud.com/oauth2/token"
-SOUNDCLOUD_API_BASE_URL = "https://api.soundcloud.com"
 
+job_queue = get_queue()
 
-def find_best_match(track_name, artist_name, soundcloud_tracks):
-    for track in soundcloud_tracks:
-        if isinstance(track, dict):
-            logging.info(f"Picked first match for '{track_name}' by '{artist_name}': {track.get('title')}")
-            return track
-    logging.warning(f"No valid track dict found for: {track_name}")
-    return None
+# Template each job kind's result is rendered with once a worker finishes it
+RESULT_TEMPLATES = {
+    "transfer_playlist_spotify": "transfer_playlist_spotify.html",
+    "transfer_playlist_soundcloud": "transfer_playlist_soundcloud.html",
+    "complete_transfer": "transfer_success.html",
+}
 
 
-def clean_track_query(title, artist):
-    title = re.sub(r"\(.*?\)|\[.*?\]|- .*", "", title)
-    title = title.replace("feat.", "").replace("ft.", "").lower()
-    return f"{title.strip()} {artist.lower().strip()}"
+def transfer_owner():
+    # Ties queued jobs to the browser session that started them
+    if "transfer_owner" not in session:
+        session["transfer_owner"] = uuid.uuid4().hex
+    return session["transfer_owner"]
+
+
+def enqueue_transfer(kind, payload):
+    job_id = job_queue.enqueue(kind, payload, owner=transfer_owner())
+    return redirect(f"/transfer_status/{job_id}")
 
 
 @app.route("/")
@@ -151,137 +154,11 @@ def transfer_playlist_spotify(playlist_id):
         logging.warning("User is not logged into SoundCloud. Redirecting to login.")
         return redirect("/login_soundcloud")
 
-    headers = {"Authorization": f"Bearer {session['spotify_token']}"}
-    response = requests.get(f"{SPOTIFY_API_BASE_URL}/playlists/{playlist_id}", headers=headers)
-    if response.status_code != 200:
-        logging.error(
-            f"Failed to fetch Spotify playlist. Status Code: {response.status_code}, Response: {response.text}")
-        return render_template("transfer_playlist_spotify.html", playlist_name="Unknown Playlist", tracks=[],
-                               success=False, message="Failed to fetch playlist from Spotify. Please try again.")
-
-    playlist_data = response.json()
-    playlist_name = playlist_data.get("name", "Transferred Playlist")
-    playlist_description = playlist_data.get("description", "")
-    tracks_data = playlist_data.get("tracks", {}).get("items", [])
-    track_list = []
-    soundcloud_track_ids = []
-
-    for item in tracks_data:
-        track = item.get("track")
-        if not track:
-            logging.warning("Skipped a None track (possibly deleted or unavailable).")
-            continue
-
-        track_name = track.get("name", "Unknown Track")
-        artist_name = track.get("artists", [{}])[0].get("name", "Unknown Artist")
-        album_image = track.get("album", {}).get("images", [{}])[0].get("url", "/static/default-cover.jpg")
-
-        track_list.append({
-            "name": track_name,
-            "artist": artist_name,
-            "album_image": album_image
-        })
-
-        fallback_queries = [
-            clean_track_query(track_name, artist_name),
-            track_name.lower(),
-            f"{track_name} {artist_name.split(' ')[0]}".lower()
-        ]
-
-        token = session.get("soundcloud_token")
-        soundcloud_tracks = []
-
-        for query in fallback_queries:
-            logging.info(f"Searching SoundCloud for: {query}")
-            soundcloud_response = requests.get(
-                f"{SOUNDCLOUD_API_BASE_URL}/tracks",
-                headers={"Authorization": f"OAuth {token}"},
-                params={"q": query, "limit": 5}
-            )
-            time.sleep(0.15)
-
-            if soundcloud_response.status_code == 401:
-                logging.error("SoundCloud token expired or invalid. Forcing re-login.")
-                session.pop("soundcloud_token", None)
-                return redirect("/login_soundcloud")
-
-            logging.info(f"SoundCloud Search Query: {query}")
-            logging.info(f"SoundCloud API Raw Response: {soundcloud_response.text}")
-
-            if soundcloud_response.status_code == 200:
-                try:
-                    soundcloud_tracks = soundcloud_response.json()
-                    if isinstance(soundcloud_tracks, list) and soundcloud_tracks:
-                        break
-                    else:
-                        logging.warning("No valid tracks returned in this query.")
-                except ValueError:
-                    logging.error("Invalid JSON response from SoundCloud API.")
-            else:
-                logging.error(f"SoundCloud API Error: {soundcloud_response.status_code}, {soundcloud_response.text}")
-
-        if soundcloud_tracks:
-            logging.info(f"Got {len(soundcloud_tracks)} tracks from SoundCloud for {track_name}")
-            best_match = find_best_match(track_name, artist_name, soundcloud_tracks)
-            if best_match:
-                soundcloud_track_ids.append(best_match["id"])
-            else:
-                logging.warning(f"No match found for track: {track_name} by {artist_name}")
-        else:
-            logging.warning(f"No results found for query: {query}")
-
-    if not soundcloud_track_ids:
-        return render_template("transfer_playlist_spotify.html", playlist_name=playlist_name, tracks=track_list,
-                               success=False,
-                               message="No matching tracks found on SoundCloud. Some tracks may not be available.")
-
-    image_url = playlist_data.get("images", [{}])[0].get("url")
-    image_data = None
-    valid_image = False
-
-    if image_url:
-        image_response = requests.get(image_url)
-        if image_response.status_code == 200:
-            content_type = image_response.headers.get("Content-Type", "")
-            if "jpeg" in content_type or image_url.lower().endswith(".jpg"):
-                raw_image = image_response.content
-                if len(raw_image) < 2 * 1024 * 1024:
-                    image_data = io.BytesIO(raw_image)
-                    image_data.name = "cover.jpg"
-                    valid_image = True
-
-    files_list = [
-        ("playlist[title]", (None, playlist_name)),
-        ("playlist[sharing]", (None, "public")),
-        ("playlist[description]", (None,
-                                   f"{playlist_description}\n\nThis playlist was created using TrackPlaylist by Zack - https://transferplaylist-2nob.onrender.com")),
-    ]
-
-    # Append all track IDs correctly
-    for track_id in soundcloud_track_ids:
-        files_list.append(("playlist[tracks][][id]", (None, str(track_id))))
-
-    # Append image if available
-    if valid_image and image_data:
-        files_list.append(("playlist[artwork_data]", ("cover.jpg", image_data, "image/jpeg")))
-        logging.info("Playlist image attached successfully.")
-    else:
-        logging.warning("Skipping image upload due to invalid image format or size.")
-
-    response = requests.post(
-        f"{SOUNDCLOUD_API_BASE_URL}/playlists",
-        headers={"Authorization": f"OAuth {session['soundcloud_token']}"},
-        files=files_list
-    )
-
-    if response.status_code != 201:
-        logging.error(
-            f"Failed to create SoundCloud playlist. Status Code: {response.status_code}, Response: {response.text}")
-        return render_template("transfer_playlist_spotify.html", playlist_name=playlist_name, tracks=track_list,
-                               success=False, message="Failed to create playlist on SoundCloud. Please try again.")
-
-    return render_template("transfer_playlist_spotify.html", playlist_name=playlist_name, tracks=track_list,
-                           success=True, message="Playlist created successfully!")
+    return enqueue_transfer("transfer_playlist_spotify", {
+        "playlist_id": playlist_id,
+        "spotify_token": session["spotify_token"],
+        "soundcloud_token": session["soundcloud_token"],
+    })
 
 
 @app.route("/choose_playlist_soundcloud")
@@ -300,93 +177,11 @@ def transfer_playlist_soundcloud(playlist_id):
     if not access_token:
         return redirect("/login_soundcloud")
 
-    # Fetch SoundCloud playlist
-    headers = {"Authorization": f"OAuth {access_token}"}
-    playlist_response = requests.get(f"https://api.soundcloud.com/playlists/{playlist_id}", headers=headers)
-    if playlist_response.status_code != 200:
-        return "Failed to fetch SoundCloud playlist", 400
-    playlist_data = playlist_response.json()
-
-    playlist_title = playlist_data.get("title", "Untitled Playlist")
-    tracks_data = playlist_data.get("tracks", [])
-    print(f"[DEBUG] Transferring SoundCloud playlist: '{playlist_title}', with {len(tracks_data)} tracks")
-
-    # Check Spotify token and refresh if needed
-    token_check = requests.get(
-        f"{SPOTIFY_API_BASE_URL}/me",
-        headers={"Authorization": f"Bearer {session.get('spotify_token')}"}
-    )
-    if token_check.status_code == 401:
-        session.pop("spotify_token", None)
-        return redirect("/login_spotify")
-
-    # Get Spotify user ID
-    user_response = requests.get(
-        f"{SPOTIFY_API_BASE_URL}/me",
-        headers={"Authorization": f"Bearer {session['spotify_token']}"}
-    )
-    if user_response.status_code != 200:
-        return "Failed to fetch Spotify user info", 400
-    user_id = user_response.json().get("id")
-    print(f"[DEBUG] Spotify user ID: {user_id}")
-
-    # Create the Spotify playlist (without description)
-    playlist_json = {
-        "name": playlist_title,
-        "public": False
-    }
-    print(f"[DEBUG] Final Playlist JSON: {json.dumps(playlist_json)}")
-    create_response = requests.post(
-        f"{SPOTIFY_API_BASE_URL}/users/{user_id}/playlists",
-        headers={
-            "Authorization": f"Bearer {session['spotify_token']}",
-            "Content-Type": "application/json"
-        },
-        data=json.dumps(playlist_json)
-    )
-    print(f"[DEBUG] Create playlist → Status: {create_response.status_code}")
-    print(f"[DEBUG] Response: {create_response.text}")
-    if create_response.status_code != 201:
-        print("[DEBUG] Failed to create Spotify playlist")
-        return "Failed to create Spotify playlist", 400
-
-    spotify_playlist_id = create_response.json().get("id")
-
-    # Search for each track on Spotify
-    track_uris = []
-    for track in tracks_data:
-        track_title = track.get("title", "Unknown Track")
-        track_artist = track.get("user", {}).get("username", "Unknown Artist")
-        query = f'track:"{track_title}" artist:"{track_artist}"'
-        print(f"[DEBUG] Searching: {query}", end="")
-
-        search_response = requests.get(
-            f"{SPOTIFY_API_BASE_URL}/search",
-            headers={"Authorization": f"Bearer {session['spotify_token']}"},
-            params={"q": query, "type": "track", "limit": 1}
-        )
-        print(
-            f" → Found: {search_response.status_code == 200 and search_response.json().get('tracks', {}).get('items')}")
-        if search_response.status_code == 200:
-            search_json = search_response.json()
-            items = search_json.get("tracks", {}).get("items")
-            if items:
-                track_uri = items[0].get("uri")
-                if track_uri:
-                    track_uris.append(track_uri)
-
-    # Add tracks to the new Spotify playlist
-    if track_uris:
-        add_response = requests.post(
-            f"{SPOTIFY_API_BASE_URL}/playlists/{spotify_playlist_id}/tracks",
-            headers={"Authorization": f"Bearer {session['spotify_token']}", "Content-Type": "application/json"},
-            data=json.dumps({"uris": track_uris})
-        )
-        print(f"[DEBUG] Added tracks → Status: {add_response.status_code}")
-        if add_response.status_code != 201:
-            return "Failed to add tracks to Spotify playlist", 400
-
-    return render_template("transfer_playlist_soundcloud.html", playlist_name=playlist_title, )
+    return enqueue_transfer("transfer_playlist_soundcloud", {
+        "playlist_id": playlist_id,
+        "soundcloud_token": access_token,
+        "spotify_token": session.get("spotify_token"),
+    })
 
 
 @app.route("/transfer_from_url")
@@ -494,167 +289,54 @@ def complete_transfer():
     if not tracks or not direction:
         return "No transfer session found", 400
 
-    added_tracks = []
-    failed_tracks = []
+    payload = {"tracks": tracks, "direction": direction}
 
     if direction == "spotify_to_soundcloud":
         sc_token = session.get("soundcloud_token")
         if not sc_token:
             return redirect("/login_soundcloud?redirect=/complete_transfer")
-
-        headers = {
-            "Authorization": f"OAuth {sc_token}"
-        }
-
-        for track in tracks:
-            query = f"{track['name']} {track['artist']}"
-            print(f"[DEBUG] Searching SoundCloud for: {query}")
-            try:
-                response = requests.get(
-                    f"{SOUNDCLOUD_API_BASE_URL}/tracks",
-                    headers=headers,
-                    params={"q": query, "limit": 1}
-                )
-                response.raise_for_status()
-                results = response.json()
-                if results:
-                    t = results[0]
-                    added_tracks.append({
-                        "name": t["title"],
-                        "artist": t["user"]["username"],
-                        "id": t["id"]
-                    })
-                else:
-                    failed_tracks.append(query)
-            except Exception as e:
-                print(f"[ERROR] SoundCloud search failed for {query}: {e}")
-                failed_tracks.append(query)
-
-        if not added_tracks:
-            return "No tracks were matched on SoundCloud", 400
-
-        try:
-            playlist_data = {
-                "playlist": {
-                    "title": session.pop("playlist_name", "Transferred from Spotify"),
-                    "sharing": "public",
-                    "tracks": [{"id": t["id"]} for t in added_tracks],
-                }
-            }
-
-            # Add image if available
-            image_url = session.pop("playlist_image_url", None)
-            if image_url:
-                image_response = requests.get(image_url)
-                if image_response.status_code == 200:
-                    content_type = image_response.headers.get("Content-Type", "")
-                    if "jpeg" in content_type or image_url.lower().endswith(".jpg"):
-                        raw_image = image_response.content
-                        if len(raw_image) < 2 * 1024 * 1024:
-                            playlist_data["playlist"]["artwork_data"] = base64.b64encode(raw_image).decode('utf-8')
-
-            playlist_response = requests.post(
-                f"{SOUNDCLOUD_API_BASE_URL}/playlists",
-                headers=headers,
-                json=playlist_data
-            )
-            playlist_response.raise_for_status()
-            playlist = playlist_response.json()
-        except Exception as e:
-            return f"Failed to create SoundCloud playlist: {e}", 500
-
-        return render_template(
-            "transfer_success.html",
-            playlist_name=playlist["title"],
-            tracks=added_tracks,
-            success=True
-        )
+        payload["soundcloud_token"] = sc_token
+        payload["playlist_name"] = session.pop("playlist_name", None)
+        payload["playlist_image_url"] = session.pop("playlist_image_url", None)
 
     elif direction == "soundcloud_to_spotify":
         sp_token = session.get("spotify_token")
         if not sp_token:
             return redirect("/login_spotify?redirect=/complete_transfer")
+        payload["spotify_token"] = sp_token
+        payload["playlist_artwork_url"] = session.pop("playlist_artwork_url", None)
 
-        headers = {"Authorization": f"Bearer {sp_token}"}
-
-        try:
-            user_info = requests.get(f"{SPOTIFY_API_BASE_URL}/me", headers=headers).json()
-            user_id = user_info["id"]
-
-            playlist_data = {"name": "Transferred from SoundCloud", "public": False}
-            playlist_response = requests.post(
-                f"{SPOTIFY_API_BASE_URL}/users/{user_id}/playlists",
-                headers=headers,
-                json=playlist_data
-            ).json()
-            playlist_id = playlist_response["id"]
-
-            image_url = session.pop("playlist_artwork_url", None)
-            if image_url:
-                image_url = image_url.replace("-large", "-t500x500")  # Higher resolution
-                try:
-                    img_response = requests.get(image_url)
-                    if img_response.status_code == 200:
-                        image_data = img_response.content
-                        encoded_image = base64.b64encode(image_data).decode('utf-8')
-                        upload_headers = {
-                            "Authorization": f"Bearer {sp_token}",
-                            "Content-Type": "image/jpeg"
-                        }
-                        upload_cover = requests.put(
-                            f"{SPOTIFY_API_BASE_URL}/playlists/{playlist_id}/images",
-                            headers=upload_headers,
-                            data=encoded_image
-                        )
-                        if upload_cover.status_code == 202:
-                            print("[DEBUG] Playlist cover uploaded successfully")
-                        else:
-                            print(
-                                f"[WARNING] Failed to upload cover image: {upload_cover.status_code}, {upload_cover.text}")
-                except Exception as e:
-                    print(f"[ERROR] Error downloading/uploading cover image: {e}")
-
-        except Exception as e:
-            return f"Failed to create Spotify playlist: {e}", 500
-
-        track_uris = []
-        for query in tracks:
-            try:
-                r = requests.get(
-                    f"{SPOTIFY_API_BASE_URL}/search",
-                    headers=headers,
-                    params={"q": query, "type": "track", "limit": 1}
-                )
-                r.raise_for_status()
-                items = r.json().get("tracks", {}).get("items", [])
-                if items:
-                    track = items[0]
-                    track_uris.append(track["uri"])
-                    added_tracks.append({
-                        "name": track["name"],
-                        "artist": track["artists"][0]["name"]
-                    })
-                else:
-                    failed_tracks.append(query)
-            except Exception as e:
-                print(f"[ERROR] Spotify search failed for {query}: {e}")
-                failed_tracks.append(query)
-
-        if track_uris:
-            try:
-                requests.post(
-                    f"{SPOTIFY_API_BASE_URL}/playlists/{playlist_id}/tracks",
-                    headers=headers,
-                    json={"uris": track_uris}
-                )
-            except Exception as e:
-                return f"Failed to add tracks to Spotify playlist: {e}", 500
-
-        return render_template(
-            "transfer_success.html",
-            playlist_name="Transferred from SoundCloud",
-            tracks=added_tracks,
-            success=len(added_tracks) > 0
-        )
-
-    return "Unknown transfer direction", 400
+    else:
+        return "Unknown transfer direction", 400
+
+    return enqueue_transfer("complete_transfer", payload)
+
+
+@app.route("/transfer_status/<job_id>")
+def transfer_status(job_id):
+    job = job_queue.get(job_id)
+    if not job or job["owner"] != session.get("transfer_owner"):
+        return "Transfer not found", 404
+
+    # Nothing else notices stale jobs when every worker is down, so settle them here
+    if job["status"] == RUNNING and job["lease_expires_at"] < time.time():
+        job_queue.requeue_expired()
+        job = job_queue.get(job_id)
+    if job["status"] == QUEUED and time.time() - job["queued_at"] > QUEUED_TIMEOUT_SECONDS:
+        job_queue.expire_queued(QUEUED_TIMEOUT_SECONDS)
+        job = job_queue.get(job_id)
+
+    if job["status"] in (QUEUED, RUNNING):
+        return render_template("transfer_pending.html", job_id=job_id, status=job["status"])
+
+    if job["status"] == FAILED:
+        error = job["error"] or {}
+        if error.get("relogin") == "spotify":
+            session.pop("spotify_token", None)
+            return redirect("/login_spotify")
+        if error.get("relogin") == "soundcloud":
+            session.pop("soundcloud_token", None)
+            return redirect("/login_soundcloud")
+        return error.get("message", "Transfer failed"), error.get("status_code", 500)
+
+    return render_template(RESULT_TEMPLATES[job["kind"]], **job["result"])
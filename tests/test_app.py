@@ -0,0 +1,97 @@
+import pytest
+
+from transfer_queue import SQLiteTransferQueue, QUEUED, FAILED
+
+
+@pytest.fixture
+def web(tmp_path, monkeypatch):
+    # app builds its queue on import; point that at a scratch file, then swap in a fresh one per test
+    monkeypatch.setenv("TRANSFER_QUEUE_URL", f"sqlite:///{tmp_path / 'import.db'}")
+    import app
+
+    queue = SQLiteTransferQueue(str(tmp_path / "queue.db"))
+    monkeypatch.setattr(app, "job_queue", queue)
+    app.app.config["TESTING"] = True
+    return app.app, queue
+
+
+def start_transfer(client):
+    with client.session_transaction() as session:
+        session["spotify_token"] = "sp-token"
+        session["soundcloud_token"] = "sc-token"
+    response = client.get("/transfer_playlist_spotify/abc")
+    assert response.status_code == 302
+    return response.headers["Location"].rsplit("/", 1)[1]
+
+
+def test_status_is_only_visible_to_the_session_that_started_it(web):
+    app, queue = web
+    owner = app.test_client()
+    job_id = start_transfer(owner)
+
+    assert owner.get(f"/transfer_status/{job_id}").status_code == 200
+    assert app.test_client().get(f"/transfer_status/{job_id}").status_code == 404
+
+
+def test_relogin_failure_pops_token_and_redirects(web):
+    app, queue = web
+    client = app.test_client()
+    job_id = start_transfer(client)
+    queue.claim("worker-1")
+    queue.fail(job_id, "worker-1", {"message": "expired", "status_code": 401, "relogin": "spotify"})
+
+    response = client.get(f"/transfer_status/{job_id}")
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith("/login_spotify")
+    with client.session_transaction() as session:
+        assert "spotify_token" not in session
+        assert session["soundcloud_token"] == "sc-token"
+
+
+def test_other_session_cannot_clear_tokens(web):
+    app, queue = web
+    job_id = start_transfer(app.test_client())
+    queue.claim("worker-1")
+    queue.fail(job_id, "worker-1", {"message": "expired", "status_code": 401, "relogin": "spotify"})
+
+    other = app.test_client()
+    with other.session_transaction() as session:
+        session["spotify_token"] = "other-token"
+    assert other.get(f"/transfer_status/{job_id}").status_code == 404
+    with other.session_transaction() as session:
+        assert session["spotify_token"] == "other-token"
+
+
+def test_finished_job_renders_result(web):
+    app, queue = web
+    client = app.test_client()
+    job_id = start_transfer(client)
+    queue.claim("worker-1")
+    queue.complete(job_id, "worker-1", {"playlist_name": "Road Trip", "tracks": [], "success": True,
+                                        "message": "Playlist created successfully!"})
+
+    response = client.get(f"/transfer_status/{job_id}")
+    assert response.status_code == 200
+    assert "Tracks transferred successfully!" in response.get_data(as_text=True)
+
+
+def test_expired_lease_is_requeued_when_no_worker_is_left(web):
+    app, queue = web
+    client = app.test_client()
+    job_id = start_transfer(client)
+    queue.claim("worker-1", lease_seconds=-1)
+
+    assert client.get(f"/transfer_status/{job_id}").status_code == 200
+    assert queue.get(job_id)["status"] == QUEUED
+
+
+def test_unclaimed_job_times_out(web, monkeypatch):
+    app, queue = web
+    import app as app_module
+    monkeypatch.setattr(app_module, "QUEUED_TIMEOUT_SECONDS", -1)
+    client = app.test_client()
+    job_id = start_transfer(client)
+
+    response = client.get(f"/transfer_status/{job_id}")
+    assert response.status_code == 503
+    assert queue.get(job_id)["status"] == FAILED
@@ -0,0 +1,178 @@
+import os
+import time
+
+import pytest
+
+import transfer_queue
+from transfer_queue import PostgresTransferQueue, SQLiteTransferQueue, TransferQueue, QUEUED, RUNNING, DONE, FAILED
+
+PAYLOAD = {"playlist_id": "abc", "spotify_token": "sp-token", "soundcloud_token": "sc-token"}
+
+# A negative lease is already expired, so tests don't have to sleep
+EXPIRED = -1
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def queue(request, tmp_path):
+    if request.param == "sqlite":
+        yield SQLiteTransferQueue(str(tmp_path / "queue.db"))
+        return
+
+    # Runs the same tests against a throwaway Postgres database when one is configured
+    dsn = os.getenv("TRANSFER_TEST_DATABASE_URL")
+    if not dsn:
+        pytest.skip("TRANSFER_TEST_DATABASE_URL is not set")
+    psycopg2 = pytest.importorskip("psycopg2")
+    conn = psycopg2.connect(dsn)
+    with conn, conn.cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS transfer_jobs")
+    conn.close()
+    queue = PostgresTransferQueue(dsn)
+    yield queue
+    queue.close()
+
+
+def test_claim_and_complete(queue):
+    job_id = queue.enqueue("complete_transfer", PAYLOAD, owner="session-1")
+
+    job = queue.claim("worker-1")
+    assert job["id"] == job_id
+    assert job["status"] == RUNNING
+    assert job["attempts"] == 1
+    assert job["payload"] == PAYLOAD
+    assert queue.claim("worker-2") is None
+
+    assert queue.complete(job_id, "worker-1", {"playlist_name": "Mix"})
+    job = queue.get(job_id)
+    assert job["status"] == DONE
+    assert job["result"] == {"playlist_name": "Mix"}
+    assert job["owner"] == "session-1"
+    assert job["payload"] is None
+
+
+def test_fail_drops_payload(queue):
+    job_id = queue.enqueue("complete_transfer", PAYLOAD)
+    queue.claim("worker-1")
+
+    assert queue.fail(job_id, "worker-1", {"message": "nope", "status_code": 400})
+    job = queue.get(job_id)
+    assert job["status"] == FAILED
+    assert job["error"] == {"message": "nope", "status_code": 400}
+    assert job["payload"] is None
+
+
+def test_expired_lease_is_requeued(queue):
+    job_id = queue.enqueue("complete_transfer", PAYLOAD)
+    queue.claim("worker-1", lease_seconds=EXPIRED)
+
+    queue.requeue_expired()
+    assert queue.get(job_id)["status"] == QUEUED
+
+    job = queue.claim("worker-2")
+    assert job["id"] == job_id
+    assert job["worker_id"] == "worker-2"
+    assert job["attempts"] == 2
+    assert job["payload"] == PAYLOAD
+
+
+def test_checkpoint_survives_requeue(queue):
+    job_id = queue.enqueue("complete_transfer", PAYLOAD)
+    queue.claim("worker-1", lease_seconds=EXPIRED)
+    assert queue.checkpoint(job_id, "worker-1", {"spotify_playlist_id": "p1"})
+
+    job = queue.claim("worker-2")
+    assert job["state"] == {"spotify_playlist_id": "p1"}
+
+
+def test_max_attempts_marks_failed(queue):
+    job_id = queue.enqueue("complete_transfer", PAYLOAD, max_attempts=2)
+    queue.claim("worker-1", lease_seconds=EXPIRED)
+    queue.claim("worker-2", lease_seconds=EXPIRED)
+
+    assert queue.claim("worker-3") is None
+    job = queue.get(job_id)
+    assert job["status"] == FAILED
+    assert job["attempts"] == 2
+    assert job["payload"] is None
+
+
+def test_stale_worker_cannot_touch_job(queue):
+    job_id = queue.enqueue("complete_transfer", PAYLOAD)
+    queue.claim("worker-1", lease_seconds=EXPIRED)
+    queue.claim("worker-2")
+
+    assert not queue.heartbeat(job_id, "worker-1")
+    assert not queue.checkpoint(job_id, "worker-1", {"result": {}})
+    assert not queue.complete(job_id, "worker-1", {})
+    assert not queue.fail(job_id, "worker-1", {})
+    assert queue.heartbeat(job_id, "worker-2")
+    assert queue.get(job_id)["status"] == RUNNING
+
+
+def test_unclaimed_job_times_out(queue):
+    job_id = queue.enqueue("complete_transfer", PAYLOAD)
+
+    assert queue.expire_queued(timeout=60) == 0
+    assert queue.expire_queued(timeout=-1) == 1
+    job = queue.get(job_id)
+    assert job["status"] == FAILED
+    assert job["error"]["status_code"] == 503
+    assert job["payload"] is None
+
+
+def test_purge_removes_only_finished_jobs(queue):
+    done_id = queue.enqueue("complete_transfer", PAYLOAD)
+    queue.claim("worker-1")
+    queue.complete(done_id, "worker-1", {})
+    queued_id = queue.enqueue("complete_transfer", PAYLOAD)
+
+    assert queue.purge(older_than=60) == 0
+    assert queue.purge(older_than=-1) == 1
+    assert queue.get(done_id) is None
+    assert queue.get(queued_id)["status"] == QUEUED
+
+
+def test_incomplete_backend_is_rejected():
+    class HalfQueue(TransferQueue):
+        def enqueue(self, kind, payload, owner=None, max_attempts=3):
+            return "job"
+
+    with pytest.raises(TypeError):
+        HalfQueue()
+
+
+def test_sqlite_refused_when_services_are_separate(tmp_path, monkeypatch):
+    monkeypatch.delenv("TRANSFER_QUEUE_URL", raising=False)
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    monkeypatch.setenv("DYNO", "worker.1")
+
+    with pytest.raises(RuntimeError):
+        transfer_queue.get_queue(f"sqlite:///{tmp_path / 'queue.db'}")
+
+
+def test_requeued_job_gets_a_fresh_queued_timeout(queue):
+    first = queue.enqueue("complete_transfer", PAYLOAD)
+    second = queue.enqueue("complete_transfer", PAYLOAD)
+    queue.claim("worker-1", lease_seconds=0.05)
+    queue.claim("worker-2", lease_seconds=0.05)
+    time.sleep(0.1)
+
+    # Both leases expire; one job is re-claimed and the other waits in the queue,
+    # which must not count as waiting since it was created
+    assert queue.claim("worker-3")["id"] == first
+    assert queue.expire_queued(timeout=0.08) == 0
+    job = queue.get(second)
+    assert job["status"] == QUEUED
+    assert job["queued_at"] > job["created_at"]
+
+
+def test_requeue_expired_without_claiming(queue):
+    job_id = queue.enqueue("complete_transfer", PAYLOAD)
+    queue.claim("worker-1", lease_seconds=EXPIRED)
+    before = time.time()
+
+    queue.requeue_expired()
+    job = queue.get(job_id)
+    assert job["status"] == QUEUED
+    assert job["worker_id"] is None
+    assert job["queued_at"] >= before
@@ -0,0 +1,152 @@
+import pytest
+
+import transfers
+from transfers import SPOTIFY_API_BASE_URL, SOUNDCLOUD_API_BASE_URL
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, json_data=None):
+        self.status_code = status_code
+        self._json = json_data
+        self.text = str(json_data)
+        self.headers = {}
+        self.content = b""
+
+    def json(self):
+        return self._json
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+
+class FakeRequests:
+    """Answers by (method, url) and records every call, so tests can assert which writes happened."""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.calls = []
+
+    def _call(self, method, url, **kwargs):
+        assert "timeout" in kwargs, f"{method} {url} has no timeout"
+        self.calls.append((method, url))
+        return self.routes[(method, url)]
+
+    def get(self, url, **kwargs):
+        return self._call("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._call("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self._call("PUT", url, **kwargs)
+
+    def posted(self):
+        return [url for method, url in self.calls if method == "POST"]
+
+
+class FakeJob:
+    def __init__(self, state=None):
+        self.state = dict(state or {})
+
+    def check(self):
+        pass
+
+    def checkpoint(self, key, value):
+        self.state[key] = value
+
+
+def fake_requests(monkeypatch, routes):
+    fake = FakeRequests(routes)
+    monkeypatch.setattr(transfers, "requests", fake)
+    monkeypatch.setattr(transfers.time, "sleep", lambda seconds: None)
+    return fake
+
+
+SOUNDCLOUD_PLAYLIST = {"title": "Mix", "tracks": [{"title": "Song", "user": {"username": "Artist"}}]}
+SPOTIFY_SEARCH = {"tracks": {"items": [{"uri": "spotify:track:1", "name": "Song", "artists": [{"name": "Artist"}]}]}}
+
+
+def soundcloud_to_spotify_routes():
+    return {
+        ("GET", f"{SOUNDCLOUD_API_BASE_URL}/playlists/42"): FakeResponse(200, SOUNDCLOUD_PLAYLIST),
+        ("GET", f"{SPOTIFY_API_BASE_URL}/me"): FakeResponse(200, {"id": "user-1"}),
+        ("POST", f"{SPOTIFY_API_BASE_URL}/users/user-1/playlists"): FakeResponse(201, {"id": "new"}),
+        ("GET", f"{SPOTIFY_API_BASE_URL}/search"): FakeResponse(200, SPOTIFY_SEARCH),
+        ("POST", f"{SPOTIFY_API_BASE_URL}/playlists/new/tracks"): FakeResponse(201, {}),
+        ("POST", f"{SPOTIFY_API_BASE_URL}/playlists/existing/tracks"): FakeResponse(201, {}),
+    }
+
+
+def test_transfer_playlist_soundcloud_checkpoints_created_playlist(monkeypatch):
+    fake = fake_requests(monkeypatch, soundcloud_to_spotify_routes())
+    job = FakeJob()
+    payload = {"playlist_id": "42", "soundcloud_token": "sc", "spotify_token": "sp"}
+
+    assert transfers.transfer_playlist_soundcloud(payload, job) == {"playlist_name": "Mix"}
+    assert job.state == {"spotify_playlist_id": "new", "tracks_added": True}
+    assert f"{SPOTIFY_API_BASE_URL}/users/user-1/playlists" in fake.posted()
+
+
+def test_transfer_playlist_soundcloud_retry_reuses_playlist(monkeypatch):
+    fake = fake_requests(monkeypatch, soundcloud_to_spotify_routes())
+    job = FakeJob({"spotify_playlist_id": "existing"})
+    payload = {"playlist_id": "42", "soundcloud_token": "sc", "spotify_token": "sp"}
+
+    transfers.transfer_playlist_soundcloud(payload, job)
+    assert fake.posted() == [f"{SPOTIFY_API_BASE_URL}/playlists/existing/tracks"]
+
+
+def test_transfer_playlist_soundcloud_retry_skips_added_tracks(monkeypatch):
+    fake = fake_requests(monkeypatch, soundcloud_to_spotify_routes())
+    job = FakeJob({"spotify_playlist_id": "existing", "tracks_added": True})
+    payload = {"playlist_id": "42", "soundcloud_token": "sc", "spotify_token": "sp"}
+
+    transfers.transfer_playlist_soundcloud(payload, job)
+    assert fake.posted() == []
+
+
+def test_complete_transfer_to_spotify_retry_reuses_playlist(monkeypatch):
+    fake = fake_requests(monkeypatch, soundcloud_to_spotify_routes())
+    job = FakeJob({"spotify_playlist_id": "existing"})
+    payload = {"direction": "soundcloud_to_spotify", "tracks": ["Song Artist"], "spotify_token": "sp"}
+
+    result = transfers.complete_transfer(payload, job)
+    assert result["success"]
+    assert fake.posted() == [f"{SPOTIFY_API_BASE_URL}/playlists/existing/tracks"]
+    assert job.state["tracks_added"]
+
+
+@pytest.mark.parametrize("handler", [transfers.transfer_playlist_spotify, transfers.complete_transfer])
+def test_retry_returns_saved_result_without_requests(monkeypatch, handler):
+    fake = fake_requests(monkeypatch, {})
+    saved = {"playlist_name": "Mix", "tracks": [], "success": True}
+
+    assert handler({}, FakeJob({"result": saved})) == saved
+    assert fake.calls == []
+
+
+def test_complete_transfer_to_soundcloud_checkpoints_result(monkeypatch):
+    fake = fake_requests(monkeypatch, {
+        ("GET", f"{SOUNDCLOUD_API_BASE_URL}/tracks"): FakeResponse(
+            200, [{"id": 7, "title": "Song", "user": {"username": "Artist"}}]),
+        ("POST", f"{SOUNDCLOUD_API_BASE_URL}/playlists"): FakeResponse(201, {"title": "Mix"}),
+    })
+    job = FakeJob()
+    payload = {"direction": "spotify_to_soundcloud", "tracks": [{"name": "Song", "artist": "Artist"}],
+               "soundcloud_token": "sc", "playlist_name": "Mix"}
+
+    result = transfers.complete_transfer(payload, job)
+    assert job.state["result"] == result
+    assert fake.posted() == [f"{SOUNDCLOUD_API_BASE_URL}/playlists"]
+
+
+def test_spotify_401_asks_for_relogin(monkeypatch):
+    routes = soundcloud_to_spotify_routes()
+    routes[("GET", f"{SPOTIFY_API_BASE_URL}/me")] = FakeResponse(401, {})
+    fake_requests(monkeypatch, routes)
+    payload = {"playlist_id": "42", "soundcloud_token": "sc", "spotify_token": "sp"}
+
+    with pytest.raises(transfers.TransferError) as error:
+        transfers.transfer_playlist_soundcloud(payload, FakeJob())
+    assert error.value.relogin == "spotify"
@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+import worker
+from transfer_queue import SQLiteTransferQueue, RUNNING, DONE, FAILED
+from transfers import TransferError
+from worker import JobContext, LeaseLost
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLiteTransferQueue(str(tmp_path / "queue.db"))
+
+
+def run(queue, kind, handler, monkeypatch, **kwargs):
+    monkeypatch.setitem(worker.HANDLERS, kind, handler)
+    job_id = queue.enqueue(kind, {"spotify_token": "sp-token"})
+    worker.process_job(queue, queue.claim("worker-1"), "worker-1", **kwargs)
+    return queue.get(job_id)
+
+
+def test_successful_job_completes(queue, monkeypatch):
+    job = run(queue, "ok", lambda payload, job: {"playlist_name": payload["spotify_token"]}, monkeypatch)
+    assert job["status"] == DONE
+    assert job["result"] == {"playlist_name": "sp-token"}
+
+
+def test_lease_lost_records_no_outcome(queue, monkeypatch):
+    def handler(payload, job):
+        raise LeaseLost(job.job_id)
+
+    job = run(queue, "lost", handler, monkeypatch)
+    assert job["status"] == RUNNING
+    assert job["result"] is None
+    assert job["error"] is None
+
+
+def test_transfer_error_fails_with_relogin_hint(queue, monkeypatch):
+    def handler(payload, job):
+        raise TransferError("Spotify token expired or invalid.", 401, relogin="spotify")
+
+    job = run(queue, "relogin", handler, monkeypatch)
+    assert job["status"] == FAILED
+    assert job["error"] == {"message": "Spotify token expired or invalid.", "status_code": 401, "relogin": "spotify"}
+
+
+def test_unknown_kind_fails(queue):
+    job_id = queue.enqueue("no_such_kind", {})
+    worker.process_job(queue, queue.claim("worker-1"), "worker-1")
+
+    job = queue.get(job_id)
+    assert job["status"] == FAILED
+    assert "no_such_kind" in job["error"]["message"]
+
+
+def test_job_past_time_limit_is_stopped(queue, monkeypatch):
+    def handler(payload, job):
+        while True:
+            job.check()
+            time.sleep(0.01)
+
+    job = run(queue, "slow", handler, monkeypatch, lease_seconds=0.06, max_seconds=0.05)
+    assert job["status"] == FAILED
+    assert job["error"]["status_code"] == 504
+
+
+def test_checkpoint_after_losing_lease_raises(queue):
+    job_id = queue.enqueue("complete_transfer", {})
+    job = queue.claim("worker-1", lease_seconds=-1)
+    queue.claim("worker-2")
+
+    context = JobContext(queue, job, "worker-1", threading.Event())
+    with pytest.raises(LeaseLost):
+        context.checkpoint("spotify_playlist_id", "p1")
+    with pytest.raises(LeaseLost):
+        context.check()
+    assert queue.get(job_id)["state"] is None
+
+
+class FakeQueue:
+    def __init__(self, heartbeat):
+        self.heartbeat = heartbeat
+
+
+def keep_lease(queue, lease_seconds=0.03, deadline=None):
+    done, lost, timed_out = threading.Event(), threading.Event(), threading.Event()
+    thread = threading.Thread(
+        target=worker._keep_lease,
+        args=(queue, "job", "worker-1", lease_seconds, done, lost, deadline or time.monotonic() + 60, timed_out)
+    )
+    thread.start()
+    return done, lost, timed_out, thread
+
+
+def test_keep_lease_sets_lost_when_heartbeat_is_refused():
+    done, lost, timed_out, thread = keep_lease(FakeQueue(lambda *args: False))
+    assert lost.wait(1)
+    thread.join(1)
+    assert not thread.is_alive()
+    assert not timed_out.is_set()
+
+
+def test_keep_lease_sets_lost_when_heartbeat_keeps_raising():
+    def heartbeat(*args):
+        raise RuntimeError("database is locked")
+
+    started = time.monotonic()
+    done, lost, timed_out, thread = keep_lease(FakeQueue(heartbeat))
+    assert lost.wait(1)
+    assert time.monotonic() - started >= 0.03
+    thread.join(1)
+
+
+def test_keep_lease_rides_out_a_single_heartbeat_error():
+    calls = []
+
+    def heartbeat(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        return True
+
+    done, lost, timed_out, thread = keep_lease(FakeQueue(heartbeat), lease_seconds=0.06)
+    time.sleep(0.2)
+    done.set()
+    thread.join(1)
+    assert len(calls) > 2
+    assert not lost.is_set()
+
+
+def test_keep_lease_stops_at_deadline():
+    done, lost, timed_out, thread = keep_lease(FakeQueue(lambda *args: True), deadline=time.monotonic())
+    assert timed_out.wait(1)
+    assert lost.is_set()
+    thread.join(1)
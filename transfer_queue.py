@@ -0,0 +1,374 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+DEFAULT_QUEUE_URL = "sqlite:///transfer_queue.db"
+DEFAULT_LEASE_SECONDS = 60
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_QUEUED_TIMEOUT_SECONDS = 10 * 60
+DEFAULT_RETENTION_SECONDS = 24 * 60 * 60
+DEFAULT_POOL_SIZE = int(os.getenv("TRANSFER_QUEUE_POOL_SIZE", "5"))
+
+# Read by both the web app, when it shows a job's status, and the worker loop
+QUEUED_TIMEOUT_SECONDS = float(os.getenv("TRANSFER_QUEUED_TIMEOUT_SECONDS", str(DEFAULT_QUEUED_TIMEOUT_SECONDS)))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class TransferQueue(ABC):
+    """Interface shared by every queue backend.
+
+    A worker claims a job, which leases it for ``lease_seconds``. While the
+    transfer runs the worker keeps calling ``heartbeat`` to extend the lease.
+    If the worker dies the lease runs out and the job is re-queued for another
+    worker, until ``max_attempts`` is reached and the job is marked failed.
+    Handlers record progress with ``checkpoint`` so a retry can skip work the
+    previous attempt already did. Once a job is done or failed its payload,
+    which holds the user's OAuth tokens, is dropped.
+    """
+
+    @abstractmethod
+    def enqueue(self, kind, payload, owner=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        ...
+
+    @abstractmethod
+    def claim(self, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        ...
+
+    @abstractmethod
+    def heartbeat(self, job_id, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        ...
+
+    @abstractmethod
+    def checkpoint(self, job_id, worker_id, state):
+        ...
+
+    @abstractmethod
+    def complete(self, job_id, worker_id, result):
+        ...
+
+    @abstractmethod
+    def fail(self, job_id, worker_id, error):
+        ...
+
+    @abstractmethod
+    def requeue_expired(self):
+        ...
+
+    @abstractmethod
+    def expire_queued(self, timeout=QUEUED_TIMEOUT_SECONDS):
+        ...
+
+    @abstractmethod
+    def purge(self, older_than=DEFAULT_RETENTION_SECONDS):
+        ...
+
+    @abstractmethod
+    def get(self, job_id):
+        ...
+
+
+class _SQLTransferQueue(TransferQueue):
+    """Queries shared by the SQL backends."""
+
+    placeholder = "?"
+    select_next_suffix = ""
+
+    schema = [
+        """
+        CREATE TABLE IF NOT EXISTS transfer_jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            owner TEXT,
+            payload TEXT,
+            state TEXT,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            worker_id TEXT,
+            lease_expires_at DOUBLE PRECISION,
+            queued_at DOUBLE PRECISION NOT NULL,
+            result TEXT,
+            error TEXT,
+            created_at DOUBLE PRECISION NOT NULL,
+            updated_at DOUBLE PRECISION NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS transfer_jobs_status ON transfer_jobs (status, created_at)",
+    ]
+
+    def _setup(self):
+        with self._transaction() as cur:
+            for statement in self.schema:
+                cur.execute(statement)
+
+    @abstractmethod
+    def _transaction(self):
+        """Context manager yielding a cursor inside one committed transaction."""
+
+    def _execute(self, cur, query, params=()):
+        cur.execute(query.replace("?", self.placeholder), params)
+        return cur
+
+    @staticmethod
+    def _to_job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ("payload", "state", "result", "error"):
+            if job[key] is not None:
+                job[key] = json.loads(job[key])
+        return job
+
+    def enqueue(self, kind, payload, owner=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as cur:
+            self._execute(
+                cur,
+                "INSERT INTO transfer_jobs "
+                "(id, kind, owner, payload, status, max_attempts, queued_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, owner, json.dumps(payload), QUEUED, max_attempts, now, now, now)
+            )
+        logging.info(f"Enqueued {kind} job {job_id}")
+        return job_id
+
+    def _requeue_expired(self, cur, now):
+        self._execute(
+            cur,
+            "UPDATE transfer_jobs SET status = ?, error = ?, payload = NULL, worker_id = NULL, "
+            "lease_expires_at = NULL, updated_at = ? "
+            "WHERE status = ? AND lease_expires_at < ? AND attempts >= max_attempts",
+            (FAILED, json.dumps({"message": "Transfer worker stopped responding", "status_code": 500}),
+             now, RUNNING, now)
+        )
+        requeued = self._execute(
+            cur,
+            "UPDATE transfer_jobs SET status = ?, worker_id = NULL, lease_expires_at = NULL, "
+            "queued_at = ?, updated_at = ? "
+            "WHERE status = ? AND lease_expires_at < ?",
+            (QUEUED, now, now, RUNNING, now)
+        ).rowcount
+        if requeued:
+            logging.warning(f"Re-queued {requeued} job(s) whose worker lease expired")
+
+    def requeue_expired(self):
+        with self._transaction() as cur:
+            self._requeue_expired(cur, time.time())
+
+    def claim(self, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        now = time.time()
+        with self._transaction() as cur:
+            self._requeue_expired(cur, now)
+            row = self._execute(
+                cur,
+                "SELECT id FROM transfer_jobs WHERE status = ? ORDER BY created_at LIMIT 1"
+                + self.select_next_suffix,
+                (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._execute(
+                cur,
+                "UPDATE transfer_jobs SET status = ?, worker_id = ?, attempts = attempts + 1, "
+                "lease_expires_at = ?, updated_at = ? WHERE id = ?",
+                (RUNNING, worker_id, now + lease_seconds, now, row["id"])
+            )
+            job = self._execute(cur, "SELECT * FROM transfer_jobs WHERE id = ?", (row["id"],)).fetchone()
+        return self._to_job(job)
+
+    def _update_owned(self, job_id, worker_id, assignments, values):
+        with self._transaction() as cur:
+            updated = self._execute(
+                cur,
+                f"UPDATE transfer_jobs SET {assignments}, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = ?",
+                (*values, time.time(), job_id, worker_id, RUNNING)
+            ).rowcount
+        return updated == 1
+
+    def heartbeat(self, job_id, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        return self._update_owned(job_id, worker_id, "lease_expires_at = ?", (time.time() + lease_seconds,))
+
+    def checkpoint(self, job_id, worker_id, state):
+        return self._update_owned(job_id, worker_id, "state = ?", (json.dumps(state),))
+
+    def complete(self, job_id, worker_id, result):
+        return self._update_owned(
+            job_id, worker_id,
+            "status = ?, result = ?, payload = NULL, lease_expires_at = NULL",
+            (DONE, json.dumps(result))
+        )
+
+    def fail(self, job_id, worker_id, error):
+        return self._update_owned(
+            job_id, worker_id,
+            "status = ?, error = ?, payload = NULL, lease_expires_at = NULL",
+            (FAILED, json.dumps(error))
+        )
+
+    def expire_queued(self, timeout=QUEUED_TIMEOUT_SECONDS):
+        now = time.time()
+        with self._transaction() as cur:
+            expired = self._execute(
+                cur,
+                "UPDATE transfer_jobs SET status = ?, error = ?, payload = NULL, updated_at = ? "
+                "WHERE status = ? AND queued_at < ?",
+                (FAILED, json.dumps({"message": "No transfer worker is available right now. Please try again later.",
+                                     "status_code": 503}),
+                 now, QUEUED, now - timeout)
+            ).rowcount
+        if expired:
+            logging.warning(f"Gave up on {expired} job(s) no worker claimed within {timeout}s")
+        return expired
+
+    def purge(self, older_than=DEFAULT_RETENTION_SECONDS):
+        with self._transaction() as cur:
+            purged = self._execute(
+                cur,
+                "DELETE FROM transfer_jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (DONE, FAILED, time.time() - older_than)
+            ).rowcount
+        if purged:
+            logging.info(f"Purged {purged} finished job(s)")
+        return purged
+
+    def get(self, job_id):
+        with self._transaction() as cur:
+            row = self._execute(cur, "SELECT * FROM transfer_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row)
+
+
+class SQLiteTransferQueue(_SQLTransferQueue):
+    """Queue stored in a local SQLite file.
+
+    Only usable when every web and worker process shares one disk, i.e. a
+    single node. It is also what the tests run against.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+        self._setup()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # One short-lived connection per call keeps the queue safe to use from
+        # the heartbeat thread as well as the worker's main thread.
+        conn = self._connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+            except Exception:
+                conn.rollback()
+                raise
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class PostgresTransferQueue(_SQLTransferQueue):
+    """Queue stored in Postgres, shared by web and worker processes on any number of nodes.
+
+    Claims use ``FOR UPDATE SKIP LOCKED`` so concurrent workers never pick the same job.
+    Each process keeps a small thread-safe connection pool, shared by the
+    worker's heartbeat thread and its main loop.
+    """
+
+    placeholder = "%s"
+    select_next_suffix = " FOR UPDATE SKIP LOCKED"
+
+    def __init__(self, dsn, max_connections=DEFAULT_POOL_SIZE):
+        try:
+            import psycopg2
+            import psycopg2.extras
+            import psycopg2.pool
+        except ImportError:
+            raise RuntimeError("The Postgres transfer queue needs psycopg2: pip install psycopg2-binary")
+        self._broken_connection_errors = (psycopg2.OperationalError, psycopg2.InterfaceError)
+        self._cursor_factory = psycopg2.extras.RealDictCursor
+        self.dsn = dsn
+        self._pool = psycopg2.pool.ThreadedConnectionPool(1, max_connections, dsn)
+        self._setup()
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._pool.getconn()
+        broken = False
+        try:
+            with conn:
+                with conn.cursor(cursor_factory=self._cursor_factory) as cur:
+                    yield cur
+        except self._broken_connection_errors:
+            broken = True
+            raise
+        finally:
+            self._pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def close(self):
+        self._pool.closeall()
+
+
+def _sqlite_from_url(parsed):
+    # sqlite:///relative.db and sqlite:////absolute/path.db, as in SQLAlchemy
+    path = parsed.path[1:] if parsed.path.startswith("/") else parsed.path
+    return SQLiteTransferQueue(path or "transfer_queue.db")
+
+
+def _postgres_from_url(parsed):
+    return PostgresTransferQueue(parsed.geturl())
+
+
+BACKENDS = {
+    "sqlite": _sqlite_from_url,
+    "postgres": _postgres_from_url,
+    "postgresql": _postgres_from_url,
+}
+
+
+def register_backend(scheme, factory):
+    """Make ``TRANSFER_QUEUE_URL=<scheme>://...`` build a queue with ``factory(parsed_url)``."""
+    BACKENDS[scheme] = factory
+
+
+def _runs_as_separate_services():
+    # Heroku dynos and Render services each get their own filesystem
+    return bool(os.getenv("DYNO") or os.getenv("RENDER_SERVICE_ID"))
+
+
+def get_queue(url=None):
+    url = url or os.getenv("TRANSFER_QUEUE_URL") or os.getenv("DATABASE_URL") or DEFAULT_QUEUE_URL
+    parsed = urlparse(url)
+    factory = BACKENDS.get(parsed.scheme)
+    if factory is None:
+        raise ValueError(f"Unsupported transfer queue backend: {parsed.scheme}")
+    if parsed.scheme == "sqlite" and _runs_as_separate_services():
+        raise RuntimeError(
+            "The SQLite transfer queue is not shared between web and worker services. "
+            "Set DATABASE_URL or TRANSFER_QUEUE_URL to a Postgres database."
+        )
+    queue = factory(parsed)
+    if not isinstance(queue, TransferQueue):
+        raise TypeError(f"Transfer queue backend {parsed.scheme} did not return a TransferQueue")
+    return queue
@@ -0,0 +1,468 @@
+import json
+import re
+import logging
+import io
+import time
+import requests
+import base64
+
+SPOTIFY_API_BASE_URL = "https://api.spotify.com/v1"
+SOUNDCLOUD_API_BASE_URL = "https://api.soundcloud.com"
+
+# Seconds to wait on Spotify/SoundCloud before giving up on a request, so a
+# stalled connection can't hold a worker and its job forever
+REQUEST_TIMEOUT = 15
+
+
+class TransferError(Exception):
+    """A transfer that cannot finish. ``relogin`` names the service whose token was rejected."""
+
+    def __init__(self, message, status_code=400, relogin=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.relogin = relogin
+
+    def to_dict(self):
+        return {"message": self.message, "status_code": self.status_code, "relogin": self.relogin}
+
+
+def find_best_match(track_name, artist_name, soundcloud_tracks):
+    for track in soundcloud_tracks:
+        if isinstance(track, dict):
+            logging.info(f"Picked first match for '{track_name}' by '{artist_name}': {track.get('title')}")
+            return track
+    logging.warning(f"No valid track dict found for: {track_name}")
+    return None
+
+
+def clean_track_query(title, artist):
+    title = re.sub(r"\(.*?\)|\[.*?\]|- .*", "", title)
+    title = title.replace("feat.", "").replace("ft.", "").lower()
+    return f"{title.strip()} {artist.lower().strip()}"
+
+
+def transfer_playlist_spotify(payload, job):
+    if "result" in job.state:
+        return job.state["result"]
+
+    spotify_token = payload["spotify_token"]
+    soundcloud_token = payload["soundcloud_token"]
+    playlist_id = payload["playlist_id"]
+
+    headers = {"Authorization": f"Bearer {spotify_token}"}
+    response = requests.get(f"{SPOTIFY_API_BASE_URL}/playlists/{playlist_id}", headers=headers,
+                            timeout=REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        logging.error(
+            f"Failed to fetch Spotify playlist. Status Code: {response.status_code}, Response: {response.text}")
+        return {"playlist_name": "Unknown Playlist", "tracks": [], "success": False,
+                "message": "Failed to fetch playlist from Spotify. Please try again."}
+
+    playlist_data = response.json()
+    playlist_name = playlist_data.get("name", "Transferred Playlist")
+    playlist_description = playlist_data.get("description", "")
+    tracks_data = playlist_data.get("tracks", {}).get("items", [])
+    track_list = []
+    soundcloud_track_ids = []
+
+    for item in tracks_data:
+        job.check()
+        track = item.get("track")
+        if not track:
+            logging.warning("Skipped a None track (possibly deleted or unavailable).")
+            continue
+
+        track_name = track.get("name", "Unknown Track")
+        artist_name = track.get("artists", [{}])[0].get("name", "Unknown Artist")
+        album_image = track.get("album", {}).get("images", [{}])[0].get("url", "/static/default-cover.jpg")
+
+        track_list.append({
+            "name": track_name,
+            "artist": artist_name,
+            "album_image": album_image
+        })
+
+        fallback_queries = [
+            clean_track_query(track_name, artist_name),
+            track_name.lower(),
+            f"{track_name} {artist_name.split(' ')[0]}".lower()
+        ]
+
+        soundcloud_tracks = []
+
+        for query in fallback_queries:
+            logging.info(f"Searching SoundCloud for: {query}")
+            soundcloud_response = requests.get(
+                f"{SOUNDCLOUD_API_BASE_URL}/tracks",
+                headers={"Authorization": f"OAuth {soundcloud_token}"},
+                params={"q": query, "limit": 5},
+                timeout=REQUEST_TIMEOUT
+            )
+            time.sleep(0.15)
+
+            if soundcloud_response.status_code == 401:
+                logging.error("SoundCloud token expired or invalid. Forcing re-login.")
+                raise TransferError("SoundCloud token expired or invalid.", 401, relogin="soundcloud")
+
+            logging.info(f"SoundCloud Search Query: {query}")
+            logging.info(f"SoundCloud API Raw Response: {soundcloud_response.text}")
+
+            if soundcloud_response.status_code == 200:
+                try:
+                    soundcloud_tracks = soundcloud_response.json()
+                    if isinstance(soundcloud_tracks, list) and soundcloud_tracks:
+                        break
+                    else:
+                        logging.warning("No valid tracks returned in this query.")
+                except ValueError:
+                    logging.error("Invalid JSON response from SoundCloud API.")
+            else:
+                logging.error(f"SoundCloud API Error: {soundcloud_response.status_code}, {soundcloud_response.text}")
+
+        if soundcloud_tracks:
+            logging.info(f"Got {len(soundcloud_tracks)} tracks from SoundCloud for {track_name}")
+            best_match = find_best_match(track_name, artist_name, soundcloud_tracks)
+            if best_match:
+                soundcloud_track_ids.append(best_match["id"])
+            else:
+                logging.warning(f"No match found for track: {track_name} by {artist_name}")
+        else:
+            logging.warning(f"No results found for query: {query}")
+
+    if not soundcloud_track_ids:
+        return {"playlist_name": playlist_name, "tracks": track_list, "success": False,
+                "message": "No matching tracks found on SoundCloud. Some tracks may not be available."}
+
+    image_url = playlist_data.get("images", [{}])[0].get("url")
+    image_data = None
+    valid_image = False
+
+    if image_url:
+        image_response = requests.get(image_url, timeout=REQUEST_TIMEOUT)
+        if image_response.status_code == 200:
+            content_type = image_response.headers.get("Content-Type", "")
+            if "jpeg" in content_type or image_url.lower().endswith(".jpg"):
+                raw_image = image_response.content
+                if len(raw_image) < 2 * 1024 * 1024:
+                    image_data = io.BytesIO(raw_image)
+                    image_data.name = "cover.jpg"
+                    valid_image = True
+
+    files_list = [
+        ("playlist[title]", (None, playlist_name)),
+        ("playlist[sharing]", (None, "public")),
+        ("playlist[description]", (None,
+                                   f"{playlist_description}\n\nThis playlist was created using TrackPlaylist by Zack - https://transferplaylist-2nob.onrender.com")),
+    ]
+
+    # Append all track IDs correctly
+    for track_id in soundcloud_track_ids:
+        files_list.append(("playlist[tracks][][id]", (None, str(track_id))))
+
+    # Append image if available
+    if valid_image and image_data:
+        files_list.append(("playlist[artwork_data]", ("cover.jpg", image_data, "image/jpeg")))
+        logging.info("Playlist image attached successfully.")
+    else:
+        logging.warning("Skipping image upload due to invalid image format or size.")
+
+    job.check()
+    response = requests.post(
+        f"{SOUNDCLOUD_API_BASE_URL}/playlists",
+        headers={"Authorization": f"OAuth {soundcloud_token}"},
+        files=files_list,
+        timeout=REQUEST_TIMEOUT
+    )
+
+    if response.status_code != 201:
+        logging.error(
+            f"Failed to create SoundCloud playlist. Status Code: {response.status_code}, Response: {response.text}")
+        return {"playlist_name": playlist_name, "tracks": track_list, "success": False,
+                "message": "Failed to create playlist on SoundCloud. Please try again."}
+
+    result = {"playlist_name": playlist_name, "tracks": track_list, "success": True,
+              "message": "Playlist created successfully!"}
+    job.checkpoint("result", result)
+    return result
+
+
+def transfer_playlist_soundcloud(payload, job):
+    access_token = payload["soundcloud_token"]
+    spotify_token = payload["spotify_token"]
+    playlist_id = payload["playlist_id"]
+
+    # Fetch SoundCloud playlist
+    headers = {"Authorization": f"OAuth {access_token}"}
+    playlist_response = requests.get(f"{SOUNDCLOUD_API_BASE_URL}/playlists/{playlist_id}", headers=headers,
+                                     timeout=REQUEST_TIMEOUT)
+    if playlist_response.status_code != 200:
+        raise TransferError("Failed to fetch SoundCloud playlist")
+    playlist_data = playlist_response.json()
+
+    playlist_title = playlist_data.get("title", "Untitled Playlist")
+    tracks_data = playlist_data.get("tracks", [])
+    print(f"[DEBUG] Transferring SoundCloud playlist: '{playlist_title}', with {len(tracks_data)} tracks")
+
+    # Check Spotify token and refresh if needed
+    token_check = requests.get(
+        f"{SPOTIFY_API_BASE_URL}/me",
+        headers={"Authorization": f"Bearer {spotify_token}"},
+        timeout=REQUEST_TIMEOUT
+    )
+    if token_check.status_code == 401:
+        raise TransferError("Spotify token expired or invalid.", 401, relogin="spotify")
+
+    # Get Spotify user ID
+    user_response = requests.get(
+        f"{SPOTIFY_API_BASE_URL}/me",
+        headers={"Authorization": f"Bearer {spotify_token}"},
+        timeout=REQUEST_TIMEOUT
+    )
+    if user_response.status_code != 200:
+        raise TransferError("Failed to fetch Spotify user info")
+    user_id = user_response.json().get("id")
+    print(f"[DEBUG] Spotify user ID: {user_id}")
+
+    # Create the Spotify playlist (without description), unless an earlier attempt already did
+    spotify_playlist_id = job.state.get("spotify_playlist_id")
+    if not spotify_playlist_id:
+        playlist_json = {
+            "name": playlist_title,
+            "public": False
+        }
+        print(f"[DEBUG] Final Playlist JSON: {json.dumps(playlist_json)}")
+        job.check()
+        create_response = requests.post(
+            f"{SPOTIFY_API_BASE_URL}/users/{user_id}/playlists",
+            headers={
+                "Authorization": f"Bearer {spotify_token}",
+                "Content-Type": "application/json"
+            },
+            data=json.dumps(playlist_json),
+            timeout=REQUEST_TIMEOUT
+        )
+        print(f"[DEBUG] Create playlist → Status: {create_response.status_code}")
+        print(f"[DEBUG] Response: {create_response.text}")
+        if create_response.status_code != 201:
+            print("[DEBUG] Failed to create Spotify playlist")
+            raise TransferError("Failed to create Spotify playlist")
+
+        spotify_playlist_id = create_response.json().get("id")
+        job.checkpoint("spotify_playlist_id", spotify_playlist_id)
+
+    # Search for each track on Spotify
+    track_uris = []
+    for track in tracks_data:
+        job.check()
+        track_title = track.get("title", "Unknown Track")
+        track_artist = track.get("user", {}).get("username", "Unknown Artist")
+        query = f'track:"{track_title}" artist:"{track_artist}"'
+        print(f"[DEBUG] Searching: {query}", end="")
+
+        search_response = requests.get(
+            f"{SPOTIFY_API_BASE_URL}/search",
+            headers={"Authorization": f"Bearer {spotify_token}"},
+            params={"q": query, "type": "track", "limit": 1},
+            timeout=REQUEST_TIMEOUT
+        )
+        print(
+            f" → Found: {search_response.status_code == 200 and search_response.json().get('tracks', {}).get('items')}")
+        if search_response.status_code == 200:
+            search_json = search_response.json()
+            items = search_json.get("tracks", {}).get("items")
+            if items:
+                track_uri = items[0].get("uri")
+                if track_uri:
+                    track_uris.append(track_uri)
+
+    # Add tracks to the new Spotify playlist
+    if track_uris and not job.state.get("tracks_added"):
+        job.check()
+        add_response = requests.post(
+            f"{SPOTIFY_API_BASE_URL}/playlists/{spotify_playlist_id}/tracks",
+            headers={"Authorization": f"Bearer {spotify_token}", "Content-Type": "application/json"},
+            data=json.dumps({"uris": track_uris}),
+            timeout=REQUEST_TIMEOUT
+        )
+        print(f"[DEBUG] Added tracks → Status: {add_response.status_code}")
+        if add_response.status_code != 201:
+            raise TransferError("Failed to add tracks to Spotify playlist")
+        job.checkpoint("tracks_added", True)
+
+    return {"playlist_name": playlist_title}
+
+
+def complete_transfer(payload, job):
+    if "result" in job.state:
+        return job.state["result"]
+
+    tracks = payload["tracks"]
+    direction = payload["direction"]
+
+    added_tracks = []
+    failed_tracks = []
+
+    if direction == "spotify_to_soundcloud":
+        headers = {
+            "Authorization": f"OAuth {payload['soundcloud_token']}"
+        }
+
+        for track in tracks:
+            job.check()
+            query = f"{track['name']} {track['artist']}"
+            print(f"[DEBUG] Searching SoundCloud for: {query}")
+            try:
+                response = requests.get(
+                    f"{SOUNDCLOUD_API_BASE_URL}/tracks",
+                    headers=headers,
+                    params={"q": query, "limit": 1},
+                    timeout=REQUEST_TIMEOUT
+                )
+                response.raise_for_status()
+                results = response.json()
+                if results:
+                    t = results[0]
+                    added_tracks.append({
+                        "name": t["title"],
+                        "artist": t["user"]["username"],
+                        "id": t["id"]
+                    })
+                else:
+                    failed_tracks.append(query)
+            except Exception as e:
+                print(f"[ERROR] SoundCloud search failed for {query}: {e}")
+                failed_tracks.append(query)
+
+        if not added_tracks:
+            raise TransferError("No tracks were matched on SoundCloud")
+
+        job.check()
+        try:
+            playlist_data = {
+                "playlist": {
+                    "title": payload.get("playlist_name") or "Transferred from Spotify",
+                    "sharing": "public",
+                    "tracks": [{"id": t["id"]} for t in added_tracks],
+                }
+            }
+
+            # Add image if available
+            image_url = payload.get("playlist_image_url")
+            if image_url:
+                image_response = requests.get(image_url, timeout=REQUEST_TIMEOUT)
+                if image_response.status_code == 200:
+                    content_type = image_response.headers.get("Content-Type", "")
+                    if "jpeg" in content_type or image_url.lower().endswith(".jpg"):
+                        raw_image = image_response.content
+                        if len(raw_image) < 2 * 1024 * 1024:
+                            playlist_data["playlist"]["artwork_data"] = base64.b64encode(raw_image).decode('utf-8')
+
+            playlist_response = requests.post(
+                f"{SOUNDCLOUD_API_BASE_URL}/playlists",
+                headers=headers,
+                json=playlist_data,
+                timeout=REQUEST_TIMEOUT
+            )
+            playlist_response.raise_for_status()
+            playlist = playlist_response.json()
+        except Exception as e:
+            raise TransferError(f"Failed to create SoundCloud playlist: {e}", 500)
+
+        result = {"playlist_name": playlist["title"], "tracks": added_tracks, "success": True}
+        job.checkpoint("result", result)
+        return result
+
+    elif direction == "soundcloud_to_spotify":
+        sp_token = payload["spotify_token"]
+        headers = {"Authorization": f"Bearer {sp_token}"}
+
+        playlist_id = job.state.get("spotify_playlist_id")
+        if not playlist_id:
+            job.check()
+            try:
+                user_info = requests.get(f"{SPOTIFY_API_BASE_URL}/me", headers=headers, timeout=REQUEST_TIMEOUT).json()
+                user_id = user_info["id"]
+
+                playlist_data = {"name": "Transferred from SoundCloud", "public": False}
+                playlist_response = requests.post(
+                    f"{SPOTIFY_API_BASE_URL}/users/{user_id}/playlists",
+                    headers=headers,
+                    json=playlist_data,
+                    timeout=REQUEST_TIMEOUT
+                ).json()
+                playlist_id = playlist_response["id"]
+            except Exception as e:
+                raise TransferError(f"Failed to create Spotify playlist: {e}", 500)
+            job.checkpoint("spotify_playlist_id", playlist_id)
+
+        # Uploading the cover again on a retry just replaces it, so it needs no checkpoint
+        image_url = payload.get("playlist_artwork_url")
+        if image_url:
+            image_url = image_url.replace("-large", "-t500x500")  # Higher resolution
+            job.check()
+            try:
+                img_response = requests.get(image_url, timeout=REQUEST_TIMEOUT)
+                if img_response.status_code == 200:
+                    image_data = img_response.content
+                    encoded_image = base64.b64encode(image_data).decode('utf-8')
+                    upload_headers = {
+                        "Authorization": f"Bearer {sp_token}",
+                        "Content-Type": "image/jpeg"
+                    }
+                    upload_cover = requests.put(
+                        f"{SPOTIFY_API_BASE_URL}/playlists/{playlist_id}/images",
+                        headers=upload_headers,
+                        data=encoded_image,
+                        timeout=REQUEST_TIMEOUT
+                    )
+                    if upload_cover.status_code == 202:
+                        print("[DEBUG] Playlist cover uploaded successfully")
+                    else:
+                        print(
+                            f"[WARNING] Failed to upload cover image: {upload_cover.status_code}, {upload_cover.text}")
+            except Exception as e:
+                print(f"[ERROR] Error downloading/uploading cover image: {e}")
+
+        track_uris = []
+        for query in tracks:
+            job.check()
+            try:
+                r = requests.get(
+                    f"{SPOTIFY_API_BASE_URL}/search",
+                    headers=headers,
+                    params={"q": query, "type": "track", "limit": 1},
+                    timeout=REQUEST_TIMEOUT
+                )
+                r.raise_for_status()
+                items = r.json().get("tracks", {}).get("items", [])
+                if items:
+                    track = items[0]
+                    track_uris.append(track["uri"])
+                    added_tracks.append({
+                        "name": track["name"],
+                        "artist": track["artists"][0]["name"]
+                    })
+                else:
+                    failed_tracks.append(query)
+            except Exception as e:
+                print(f"[ERROR] Spotify search failed for {query}: {e}")
+                failed_tracks.append(query)
+
+        if track_uris and not job.state.get("tracks_added"):
+            job.check()
+            try:
+                requests.post(
+                    f"{SPOTIFY_API_BASE_URL}/playlists/{playlist_id}/tracks",
+                    headers=headers,
+                    json={"uris": track_uris},
+                    timeout=REQUEST_TIMEOUT
+                )
+            except Exception as e:
+                raise TransferError(f"Failed to add tracks to Spotify playlist: {e}", 500)
+            job.checkpoint("tracks_added", True)
+
+        return {"playlist_name": "Transferred from SoundCloud", "tracks": added_tracks,
+                "success": len(added_tracks) > 0}
+
+    raise TransferError("Unknown transfer direction")
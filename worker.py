@@ -0,0 +1,179 @@
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+import transfers
+from transfer_queue import get_queue, DEFAULT_LEASE_SECONDS, DEFAULT_RETENTION_SECONDS, QUEUED_TIMEOUT_SECONDS
+from transfers import TransferError
+
+POLL_INTERVAL = float(os.getenv("TRANSFER_WORKER_POLL_INTERVAL", "1"))
+MAX_BACKOFF = 30
+LEASE_SECONDS = float(os.getenv("TRANSFER_LEASE_SECONDS", str(DEFAULT_LEASE_SECONDS)))
+RETENTION_SECONDS = float(os.getenv("TRANSFER_JOB_RETENTION_SECONDS", str(DEFAULT_RETENTION_SECONDS)))
+MAX_JOB_SECONDS = float(os.getenv("TRANSFER_MAX_JOB_SECONDS", str(30 * 60)))
+MAINTENANCE_INTERVAL = 60
+
+HANDLERS = {
+    "transfer_playlist_spotify": transfers.transfer_playlist_spotify,
+    "transfer_playlist_soundcloud": transfers.transfer_playlist_soundcloud,
+    "complete_transfer": transfers.complete_transfer,
+}
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class JobContext:
+    """What a handler sees of its job besides the payload.
+
+    ``state`` holds progress saved by earlier attempts. Handlers call ``check``
+    before every write to Spotify or SoundCloud and ``checkpoint`` right after
+    it, so a retry skips what is already done and a worker that lost its
+    lease, or ran past ``MAX_JOB_SECONDS``, stops instead of carrying on.
+    """
+
+    def __init__(self, queue, job, worker_id, lost):
+        self.queue = queue
+        self.job_id = job["id"]
+        self.worker_id = worker_id
+        self.state = dict(job.get("state") or {})
+        self._lost = lost
+
+    def check(self):
+        if self._lost.is_set():
+            raise LeaseLost(self.job_id)
+
+    def checkpoint(self, key, value):
+        self.check()
+        self.state[key] = value
+        if not self.queue.checkpoint(self.job_id, self.worker_id, self.state):
+            self._lost.set()
+            raise LeaseLost(self.job_id)
+
+
+def _keep_lease(queue, job_id, worker_id, lease_seconds, done, lost, deadline, timed_out):
+    last_renewed = time.monotonic()
+    while not done.wait(lease_seconds / 3):
+        if time.monotonic() >= deadline:
+            # Stop renewing, so even a handler stuck outside check() loses the job
+            logging.warning(f"Job {job_id} ran past its time limit; stopping it")
+            timed_out.set()
+            lost.set()
+            return
+        try:
+            renewed = queue.heartbeat(job_id, worker_id, lease_seconds)
+        except Exception:
+            logging.exception(f"Heartbeat for job {job_id} failed")
+            if time.monotonic() - last_renewed < lease_seconds:
+                continue
+            renewed = False
+        if not renewed:
+            logging.warning(f"Lost lease on job {job_id}; stopping it before its next write")
+            lost.set()
+            return
+        last_renewed = time.monotonic()
+
+
+def _report(action, job_id, *args):
+    # If this fails the job stays leased; once the lease runs out another
+    # worker retries it, skipping whatever was checkpointed.
+    try:
+        if not action(job_id, *args):
+            logging.warning(f"Job {job_id} finished after its lease was lost; outcome discarded")
+    except Exception:
+        logging.exception(f"Could not record the outcome of job {job_id}")
+
+
+def process_job(queue, job, worker_id, lease_seconds=LEASE_SECONDS, max_seconds=MAX_JOB_SECONDS):
+    job_id = job["id"]
+    handler = HANDLERS.get(job["kind"])
+    if handler is None:
+        logging.error(f"No handler for job {job_id} of kind {job['kind']}")
+        _report(queue.fail, job_id, worker_id, {"message": f"Unknown job kind: {job['kind']}", "status_code": 500})
+        return
+
+    done = threading.Event()
+    lost = threading.Event()
+    timed_out = threading.Event()
+    heartbeat = threading.Thread(
+        target=_keep_lease,
+        args=(queue, job_id, worker_id, lease_seconds, done, lost, time.monotonic() + max_seconds, timed_out),
+        daemon=True
+    )
+    heartbeat.start()
+    logging.info(f"Worker {worker_id} running {job['kind']} job {job_id} (attempt {job['attempts']})")
+    try:
+        result = handler(job["payload"], JobContext(queue, job, worker_id, lost))
+    except LeaseLost:
+        if timed_out.is_set():
+            _report(queue.fail, job_id, worker_id,
+                    {"message": "The transfer took too long and was stopped. Please try again.", "status_code": 504})
+        else:
+            logging.warning(f"Stopped job {job_id} after losing its lease")
+    except TransferError as e:
+        logging.warning(f"Job {job_id} failed: {e.message}")
+        _report(queue.fail, job_id, worker_id, e.to_dict())
+    except Exception as e:
+        logging.exception(f"Job {job_id} crashed")
+        _report(queue.fail, job_id, worker_id, {"message": f"Transfer failed: {e}", "status_code": 500})
+    else:
+        _report(queue.complete, job_id, worker_id, result)
+    finally:
+        done.set()
+        heartbeat.join()
+
+
+def _maintain(queue):
+    # Runs even when nobody is watching a job's status page, so abandoned jobs
+    # don't keep their tokens around or get picked up hours later
+    try:
+        queue.expire_queued(QUEUED_TIMEOUT_SECONDS)
+    except Exception:
+        logging.exception("Could not expire unclaimed jobs")
+    try:
+        queue.purge(RETENTION_SECONDS)
+    except Exception:
+        logging.exception("Could not purge finished jobs")
+
+
+def run_worker(queue=None, worker_id=None, poll_interval=POLL_INTERVAL, lease_seconds=LEASE_SECONDS,
+               burst=False):
+    """Claim and run transfer jobs until stopped, or until the queue is empty when ``burst`` is set."""
+    queue = queue or get_queue()
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    logging.info(f"Transfer worker {worker_id} started")
+    backoff = poll_interval
+    next_maintenance = time.monotonic()
+    while True:
+        if time.monotonic() >= next_maintenance:
+            _maintain(queue)
+            next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+
+        try:
+            job = queue.claim(worker_id, lease_seconds)
+        except Exception:
+            logging.exception(f"Could not claim a job; retrying in {backoff:g}s")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+            continue
+        backoff = poll_interval
+
+        if job is None:
+            if burst:
+                return
+            time.sleep(poll_interval)
+            continue
+        process_job(queue, job, worker_id, lease_seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run playlist transfer jobs from the shared queue.")
+    parser.add_argument("--burst", action="store_true", help="exit once the queue is empty")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    run_worker(burst=args.burst)